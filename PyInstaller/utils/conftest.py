@@ -10,7 +10,9 @@
 #-----------------------------------------------------------------------------
 
 import copy
+import functools
 import glob
+import hashlib
 import logging
 import os
 import platform
@@ -35,6 +37,7 @@
 sys.path.append(_ROOT_DIR)
 
 from PyInstaller import __main__ as pyi_main  # noqa: E402
+from PyInstaller import __version__ as pyi_version  # noqa: E402
 from PyInstaller import configure  # noqa: E402
 from PyInstaller.compat import architecture, is_darwin, is_win  # noqa: E402
 from PyInstaller.depend.analysis import initialize_modgraph  # noqa: E402
@@ -48,6 +51,36 @@
 SUPPORTED_OSES = {"darwin", "linux", "win32"}
 # Have pyi_builder fixure clean-up the temporary directories of successful tests. Controlled by environment variable.
 _PYI_BUILDER_CLEANUP = os.environ.get("PYI_BUILDER_CLEANUP", "1") == "1"
+# Have pyi_builder fixture keep PyInstaller's cache directory in pytest's cache, so that it is reused across test runs.
+# Controlled by environment variable.
+_PYI_BUILDER_PERSISTENT_CACHE = os.environ.get("PYI_BUILDER_PERSISTENT_CACHE", "0") == "1"
+# Have pyi_builder fixture reuse the applications built by `test_source` in previous test runs, if the source code, the
+# build arguments, and the PyInstaller sources are unchanged. Controlled by environment variable.
+_PYI_BUILDER_REUSE_BUILDS = os.environ.get("PYI_BUILDER_REUSE_BUILDS", "0") == "1"
+
+
+# Compute a fingerprint of the directory tree, based on names, sizes, and modification times of the contained files.
+# Computed only once per session for each directory.
+@functools.lru_cache(maxsize=None)
+def _tree_fingerprint(path):
+    digest = hashlib.blake2b()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(dirname for dirname in dirs if dirname != '__pycache__')
+        for filename in sorted(files):
+            filename = os.path.join(root, filename)
+            stat = os.stat(filename)
+            digest.update(f'{os.path.relpath(filename, path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Collect names and versions of all installed distributions; these include both the packages that are frozen by the
+# tests and those that provide hooks (e.g., pyinstaller-hooks-contrib). Computed only once per session.
+@functools.lru_cache(maxsize=None)
+def _installed_distributions():
+    from PyInstaller.compat import importlib_metadata
+
+    return tuple(sorted({(dist.name, dist.version) for dist in importlib_metadata.distributions() if dist.name}))
+
 
 # Fixtures
 # --------
@@ -168,14 +201,16 @@ def data_dir(
 
 
 class AppBuilder:
-    def __init__(self, tmpdir, request, bundle_mode):
+    def __init__(self, tmpdir, request, bundle_mode, cachedir=None):
         self._tmpdir = tmpdir
         self._request = request
         self._mode = bundle_mode
         self._specdir = str(tmpdir)
         self._distdir = str(tmpdir / 'dist')
         self._builddir = str(tmpdir / 'build')
+        self._cachedir = str(cachedir or tmpdir)
         self._is_spec = False
+        self._is_source = False
 
     def test_spec(self, specfile, *args, **kwargs):
         """
@@ -211,6 +246,7 @@ def test_source(self, source, *args, **kwargs):
         # For parametrized test append the test-id.
         scriptfile = gen_sourcefile(self._tmpdir, source, kwargs.setdefault('test_id'))
         del kwargs['test_id']
+        self._is_source = True
         return self.test_script(str(scriptfile), *args, **kwargs)
 
     def test_script(
@@ -252,13 +288,71 @@ def marker(line):
         assert os.path.exists(self.script), 'Script %s not found.' % script
 
         marker('Starting build.')
-        if not self._test_building(args=pyi_args):
-            pytest.fail('Building of %s failed.' % script)
+        cached_distdir = self._get_cached_distdir(pyi_args)
+        if cached_distdir and os.path.isdir(cached_distdir):
+            marker('Source unchanged, reusing cached build.')
+            shutil.copytree(cached_distdir, self._distdir, symlinks=True)
+        else:
+            if not self._test_building(args=pyi_args):
+                pytest.fail('Building of %s failed.' % script)
+            if cached_distdir:
+                self._store_cached_distdir(cached_distdir)
 
         marker('Build finished, now running executable.')
         self._test_executables(app_name, args=app_args, runtime=runtime, run_from_path=run_from_path, **kwargs)
         marker('Running executable finished.')
 
+    def _get_cached_distdir(self, pyi_args):
+        """
+        Return the path of the cached dist directory for the script and the build arguments, or None if builds should
+        not be reused.
+
+        Only scripts generated by `test_source` are considered. The cache key is computed from the script's name and
+        source, the bundle mode, the build arguments, the `PYINSTALLER_*` environment variables, python and PyInstaller
+        version, versions of all installed distributions, and the fingerprints of PyInstaller sources and of the testing
+        modules and scripts directories.
+
+        Scripts and build arguments that refer to pytest's temporary directories are never reused (nor stored), as
+        those paths change with every test run.
+        """
+        cache = getattr(self._request.config, 'cache', None)
+        if not _PYI_BUILDER_REUSE_BUILDS or not self._is_source or cache is None:
+            return None
+        with open(self.script, 'rb') as fp:
+            source = fp.read()
+        basetemp = str(self._request.getfixturevalue('tmp_path_factory').getbasetemp())
+        if basetemp.encode('utf-8') in source or any(basetemp in str(arg) for arg in pyi_args):
+            return None
+        digest = hashlib.blake2b(source)
+        key = (
+            self._mode,
+            pyi_args,
+            sys.version,
+            pyi_version,
+            os.path.basename(self.script),
+            sorted((name, value) for name, value in os.environ.items() if name.startswith('PYINSTALLER_')),
+            _installed_distributions(),
+            _tree_fingerprint(os.path.join(_ROOT_DIR, 'PyInstaller')),
+            _tree_fingerprint(_get_modules_dir(self._request)),
+            _tree_fingerprint(_get_script_dir(self._request)),
+        )
+        digest.update(repr(key).encode('utf-8'))
+        return os.path.join(str(cache.mkdir('pyi-builds')), digest.hexdigest())
+
+    def _store_cached_distdir(self, cached_distdir):
+        """
+        Store the contents of the dist directory into the cache, before the executable gets a chance to modify them.
+        """
+        # Copy into a temporary directory first, and rename it afterwards, so that concurrently running tests (e.g.,
+        # under pytest-xdist) never see a partially-copied directory.
+        tmp_distdir = f'{cached_distdir}.{os.getpid()}.tmp'
+        shutil.copytree(self._distdir, tmp_distdir, symlinks=True)
+        try:
+            os.rename(tmp_distdir, cached_distdir)
+        except OSError:
+            # Stored by another test in the meantime.
+            shutil.rmtree(tmp_distdir, ignore_errors=True)
+
     def _test_executables(self, name, args, runtime, run_from_path, **kwargs):
         """
         Run created executable to make sure it works.
@@ -433,8 +527,8 @@ def _test_building(self, args):
         pyi_args = [self.script] + default_args + args
         # TODO: fix return code in running PyInstaller programmatically.
         PYI_CONFIG = configure.get_config()
-        # Override CACHEDIR for PyInstaller and put it into self.tmpdir
-        PYI_CONFIG['cachedir'] = str(self._tmpdir)
+        # Override CACHEDIR for PyInstaller and put it into self._cachedir (by default, self.tmpdir).
+        PYI_CONFIG['cachedir'] = self._cachedir
 
         pyi_main.run(pyi_args, PYI_CONFIG)
         retcode = 0
@@ -484,9 +578,26 @@ def pyi_modgraph():
     initialize_modgraph()
 
 
+# PyInstaller's cache directory (holding the processed binaries; for example, the re-signed copies of collected binaries
+# on macOS) that is shared by all tests in the session, so that the binaries are not re-processed for every single test.
+# If persistent cache is enabled, the directory is placed into pytest's cache directory, so that it can be reused by
+# subsequent test runs; it is keyed by python version and the fingerprint of PyInstaller sources (the version string
+# does not change between commits in a development tree). In either case, each pytest-xdist worker uses its own cache
+# directory, to prevent concurrent modifications of the cache.
+@pytest.fixture(scope='session')
+def pyi_cachedir(request, tmpdir_factory):
+    cache = getattr(request.config, 'cache', None)
+    if _PYI_BUILDER_PERSISTENT_CACHE and cache is not None:
+        pyver = f'py{sys.version_info[0]}{sys.version_info[1]}'
+        worker_id = os.environ.get('PYTEST_XDIST_WORKER', 'master')
+        pyi_fingerprint = _tree_fingerprint(os.path.join(_ROOT_DIR, 'PyInstaller'))[:16]
+        return py.path.local(cache.mkdir(f'pyi-{pyver}-{pyi_fingerprint}-{worker_id}'))
+    return tmpdir_factory.mktemp('pyi_cache')
+
+
 # Run by default test as onedir and onefile.
 @pytest.fixture(params=['onedir', 'onefile'])
-def pyi_builder(tmpdir, monkeypatch, request, pyi_modgraph):
+def pyi_builder(tmpdir, monkeypatch, request, pyi_modgraph, pyi_cachedir):
     # Save/restore environment variable PATH.
     monkeypatch.setenv('PATH', os.environ['PATH'])
     # PyInstaller or a test case might manipulate 'sys.path'. Reset it for every test.
@@ -497,7 +608,7 @@ def pyi_builder(tmpdir, monkeypatch, request, pyi_modgraph):
     # as the original value.
     monkeypatch.setattr('PyInstaller.config.CONF', {'pathex': []})
 
-    yield AppBuilder(tmpdir, request, request.param)
+    yield AppBuilder(tmpdir, request, request.param, pyi_cachedir)
 
     # Clean up the temporary directory of a successful test
     if _PYI_BUILDER_CLEANUP and request.node.rep_setup.passed and request.node.rep_call.passed:
@@ -507,7 +618,7 @@ def pyi_builder(tmpdir, monkeypatch, request, pyi_modgraph):
 
 # Fixture for .spec based tests. With .spec it does not make sense to differentiate onefile/onedir mode.
 @pytest.fixture
-def pyi_builder_spec(tmpdir, request, monkeypatch, pyi_modgraph):
+def pyi_builder_spec(tmpdir, request, monkeypatch, pyi_modgraph, pyi_cachedir):
     # Save/restore environment variable PATH.
     monkeypatch.setenv('PATH', os.environ['PATH'])
     # Set current working directory to
@@ -518,7 +629,7 @@ def pyi_builder_spec(tmpdir, request, monkeypatch, pyi_modgraph):
     # as the original value.
     monkeypatch.setattr('PyInstaller.config.CONF', {'pathex': []})
 
-    yield AppBuilder(tmpdir, request, None)
+    yield AppBuilder(tmpdir, request, None, pyi_cachedir)
 
     # Clean up the temporary directory of a successful test
     if _PYI_BUILDER_CLEANUP and request.node.rep_setup.passed and request.node.rep_call.passed:
@@ -526,12 +637,8 @@ def pyi_builder_spec(tmpdir, request, monkeypatch, pyi_modgraph):
             tmpdir.remove(rec=1, ignore_errors=True)
 
 
-# Define a fixture which compiles the data/load_dll_using_ctypes/ctypes_dylib.c program in the tmpdir, returning the
-# tmpdir object.
-@pytest.fixture()
-def compiled_dylib(tmpdir, request):
-    tmp_data_dir = _data_dir_copy(request, 'ctypes_dylib', tmpdir)
-
+# Compile the ctypes_dylib.c program in the given directory, returning the path object of the compiled library.
+def _compile_ctypes_dylib(tmp_data_dir):
     # Compile the ctypes_dylib in the tmpdir: Make tmpdir/data the CWD. Do NOT use monkeypatch.chdir() to change and
     # monkeypatch.undo() to restore the CWD, since this will undo ALL monkeypatches (such as the pyi_builder's additions
     # to sys.path), breaking the test.
@@ -572,6 +679,37 @@ def compiled_dylib(tmpdir, request):
     return tmp_data_dir
 
 
+# Cache of compiled ctypes_dylib libraries, shared by all tests in the session. Maps the source data directory to the
+# path of the library compiled from it, so that the library is compiled only once.
+@pytest.fixture(scope='session')
+def compiled_dylib_cache():
+    return {}
+
+
+# Define a fixture which copies the data/ctypes_dylib directory into the tmpdir, and provides it with compiled
+# ctypes_dylib.c program, returning the path object of the library. The library is compiled only once per session, and
+# copied into the tmpdir of each test.
+@pytest.fixture()
+def compiled_dylib(tmpdir, tmpdir_factory, request, compiled_dylib_cache):
+    tmp_data_dir = _data_dir_copy(request, 'ctypes_dylib', tmpdir)
+
+    source_data_dir = os.path.join(_get_data_dir(request), 'ctypes_dylib')
+    cached_dylib = compiled_dylib_cache.get(source_data_dir)
+    if cached_dylib is None:
+        build_dir = tmpdir_factory.mktemp('ctypes_dylib')
+        shutil.copytree(source_data_dir, str(build_dir), dirs_exist_ok=True)
+        cached_dylib = compiled_dylib_cache[source_data_dir] = _compile_ctypes_dylib(build_dir)
+
+    dylib = tmp_data_dir.join(cached_dylib.basename)
+    cached_dylib.copy(dylib, mode=True)
+    if is_darwin:
+        # Update the install name of the copied library to its new location.
+        ret = subprocess.call(['install_name_tool', '-id', str(dylib), str(dylib)])
+        assert ret == 0, 'Updating the install name of ctypes_dylib failed.'
+
+    return dylib
+
+
 @pytest.fixture
 def pyi_windowed_builder(pyi_builder: AppBuilder):
     """A pyi_builder equivalent for testing --windowed applications."""
@@ -1,2 +1,7 @@
 # Bring all fixtures into this file.
+#
+# Each functional test builds its application in its own temporary directory, and session-scoped fixtures are set up
+# separately in each worker, so the tests can be freely distributed across workers using `pytest-xdist`, for example:
+#
+#   pytest -n auto tests/functional/test_import.py
 from PyInstaller.utils.conftest import *  # noqa: F401, F403
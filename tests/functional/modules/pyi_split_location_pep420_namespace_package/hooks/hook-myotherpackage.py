@@ -1,3 +1,8 @@
+from PyInstaller.utils.hooks import collect_submodules
+
+# The vendored copy of the namespace package is imported only at run-time, after its location is added to sys.path.
+hiddenimports = collect_submodules('myotherpackage._vendored.mynamespacepackage')
+
 # Collect vendored_py module as source .py module.
 module_collection_mode = {
     'myotherpackage._vendored.mynamespacepackage.vendored_py': 'py',
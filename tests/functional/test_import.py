@@ -13,18 +13,44 @@
 import os
 import sys
 import glob
+import string
+import textwrap
 import ctypes
 import ctypes.util
+import functools
 
 import pytest
 
-from PyInstaller.compat import is_win, is_darwin
-import PyInstaller.depend.utils
+from PyInstaller.compat import is_win, is_darwin, is_py310
 from PyInstaller.utils.tests import skipif, importorskip, skipif_no_compiler, xfail, has_compiler
 
 # :todo: find a way to get this from `conftest` or such
 # Directory with testing modules used in some tests.
 _MODULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules')
+# Directory with hooks used in some tests; same as `script_dir.join('pyi_hooks')`, but resolved only once.
+_PYI_HOOKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'pyi_hooks')
+
+# Eggs used by namespace package tests, indexed by the name of their parent directory (e.g., 'nspkg1-pkg'). Computed
+# once, instead of globbing the same directories in every test.
+_EGG_INDEX = {
+    entry.name: sorted(glob.glob(os.path.join(entry.path, '*.egg')))
+    for entry in os.scandir(_MODULES_DIR) if entry.is_dir() and entry.name.endswith('-pkg')
+}
+# Search paths for PEP 420 namespace package tests.
+_NSPKG_PEP420_PATHS = sorted(glob.glob(os.path.join(_MODULES_DIR, 'nspkg-pep420', 'path*')))
+
+# Paths used by the unzipped egg tests.
+_PYI_EGG_PATH = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'pyi_egg_unzipped.egg')
+_PYI_EGG_HOOKS = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'hooks')
+# Paths used by the mixed collection mode test.
+_MIXED_COLLECTION_MODE_PATH = os.path.join(_MODULES_DIR, 'pyi_mixed_collection_mode', 'modules')
+_MIXED_COLLECTION_MODE_HOOKS = os.path.join(_MODULES_DIR, 'pyi_mixed_collection_mode', 'hooks')
+# Root directories of the run-time sys.path modification tests.
+_SYS_PATH_VENDORED = os.path.join(_MODULES_DIR, 'pyi_sys_path_with_vendored_package')
+_SPLIT_NS_ROOT = os.path.join(_MODULES_DIR, 'pyi_split_location_pep420_namespace_package')
+_SPLIT_NS_MODULES = os.path.join(_SPLIT_NS_ROOT, 'modules')
+_SPLIT_NS_HOOKS = os.path.join(_SPLIT_NS_ROOT, 'hooks')
+_SPLIT_NS_EXTERNAL = os.path.join(_SPLIT_NS_ROOT, 'external-location')
 
 
 def test_nameclash(pyi_builder):
@@ -138,7 +164,7 @@ def test_import_submodule_global_unshadowed(pyi_builder):
     )
 
 
-def test_import_submodule_from_aliased_pkg(pyi_builder, script_dir):
+def test_import_submodule_from_aliased_pkg(pyi_builder):
     pyi_builder.test_source(
         """
         import sys
@@ -147,7 +173,7 @@ def test_import_submodule_from_aliased_pkg(pyi_builder, script_dir):
         sys.modules['alias_name'] = pyi_testmod_submodule_from_aliased_pkg
 
         from alias_name import submodule
-        """, ['--additional-hooks-dir=%s' % script_dir.join('pyi_hooks')]
+        """, ['--additional-hooks-dir=%s' % _PYI_HOOKS_DIR]
     )
 
 
@@ -156,11 +182,13 @@ def test_module_with_coding_utf8(pyi_builder):
     pyi_builder.test_source("import module_with_coding_utf8")
 
 
+# Collect the module's source as data file
+_UTF8_EMOJI_DATAS = os.pathsep.join((os.path.join(_MODULES_DIR, 'module_with_utf8_emoji.py'), os.curdir))
+
+
 # Test that our PyiFrozenLoader's get_source() method can load source files with utf-8 emoji characters.
 # See issue #6143.
 def test_source_utf8_emoji(pyi_builder):
-    # Collect the module's source as data file
-    datas = os.pathsep.join((os.path.join(_MODULES_DIR, 'module_with_utf8_emoji.py'), os.curdir))
     pyi_builder.test_source(
         """
         import inspect
@@ -169,7 +197,7 @@ def test_source_utf8_emoji(pyi_builder):
 
         # Retrieve source code
         source = inspect.getsource(module_with_utf8_emoji)
-        """, ['--add-data', datas]
+        """, ['--add-data', _UTF8_EMOJI_DATAS]
     )
 
 
@@ -216,19 +244,15 @@ def test_import_non_existing_raises_import_error(pyi_builder):
 #
 #     * b.py - Empty. Should be imported.
 @xfail(reason='__path__ not respected for filesystem modules.')
-def test_import_respects_path(pyi_builder, script_dir):
-    pyi_builder.test_source(
-        'import pyi_testmod_path', ['--additional-hooks-dir=' + script_dir.join('pyi_hooks').strpath]
-    )
+def test_import_respects_path(pyi_builder):
+    pyi_builder.test_source('import pyi_testmod_path', ['--additional-hooks-dir=' + _PYI_HOOKS_DIR])
 
 
 # Verify correct handling of sys.meta_path redirects like pkg_resources 28.6.1 does: '_vendor.xxx' gets imported as
 # 'extern.xxx' and using '__import__()'. Note: This also requires a hook, since 'pyi_testmod_metapath1._vendor' is not
 # imported directly and won't be found by modulegraph.
-def test_import_metapath1(pyi_builder, script_dir):
-    pyi_builder.test_source(
-        'import pyi_testmod_metapath1', ['--additional-hooks-dir=' + script_dir.join('pyi_hooks').strpath]
-    )
+def test_import_metapath1(pyi_builder):
+    pyi_builder.test_source('import pyi_testmod_metapath1', ['--additional-hooks-dir=' + _PYI_HOOKS_DIR])
 
 
 @importorskip('PyQt5')
@@ -267,21 +291,12 @@ def test_ctypes_CDLL_None(pyi_builder):
     )
 
 
-__orig_resolveCtypesImports = PyInstaller.depend.utils._resolveCtypesImports
-
-
-def __monkeypatch_resolveCtypesImports(monkeypatch, compiled_dylib):
-    def mocked_resolveCtypesImports(*args, **kwargs):
-        from PyInstaller.config import CONF
-        old_pathex = CONF['pathex']
-        CONF['pathex'].append(str(compiled_dylib))
-        res = __orig_resolveCtypesImports(*args, **kwargs)
-        CONF['pathex'] = old_pathex
-        return res
-
-    # Add the path to ctypes_dylib to pathex, only for _resolveCtypesImports. We can not monkeypath CONF['pathex'] here,
-    # as it will be overwritten when pyi_builder is starting up. So be monkeypatch _resolveCtypesImports by a wrapper.
-    monkeypatch.setattr(PyInstaller.depend.utils, "_resolveCtypesImports", mocked_resolveCtypesImports)
+# Cache the look-up results, as `ctypes.util.find_library` may spawn a subprocess (e.g., `ldconfig` or `gcc`) on every
+# call, and the same library may be required by multiple tests.
+@functools.lru_cache(maxsize=None)
+def _is_lib_available(libname):
+    soname = ctypes.util.find_library(libname)
+    return bool(soname and ctypes.CDLL(soname))
 
 
 #FIXME: For reusability, move this to "PyInstaller.utils.tests".
@@ -294,26 +309,31 @@ def skip_if_lib_missing(libname, text=None):
 
     :return: pytest decorator with a reason.
     """
-    soname = ctypes.util.find_library(libname)
     if not text:
         text = "lib%s.so" % libname
     # Return pytest decorator.
-    return skipif(not (soname and ctypes.CDLL(soname)), reason="required %s missing" % text)
-
-
-_template_ctypes_CDLL_find_library = """
-    import ctypes, ctypes.util, sys, os
-    lib = ctypes.CDLL(ctypes.util.find_library(%(libname)r))
-    print(lib)
-    assert lib is not None and lib._name is not None
-    if getattr(sys, 'frozen', False):
-        soname = ctypes.util.find_library(%(libname)r)
-        print(soname)
-        libfile = os.path.join(sys._MEIPASS, soname)
-        print(libfile)
-        assert os.path.isfile(libfile), '%%s is missing' %% soname
-        print('>>> file found')
-    """
+    return skipif(not _is_lib_available(libname), reason="required %s missing" % text)
+
+
+# The templates are compiled once, at import time. The placeholders are substituted with repr() of the values, so that
+# they end up as string literals in the test-code.
+_template_ctypes_CDLL_find_library = string.Template(
+    textwrap.dedent(
+        """
+        import ctypes, ctypes.util, sys, os
+        lib = ctypes.CDLL(ctypes.util.find_library($libname))
+        print(lib)
+        assert lib is not None and lib._name is not None
+        if getattr(sys, 'frozen', False):
+            soname = ctypes.util.find_library($libname)
+            print(soname)
+            libfile = os.path.join(sys._MEIPASS, soname)
+            print(libfile)
+            assert os.path.isfile(libfile), '%s is missing' % soname
+            print('>>> file found')
+        """
+    )
+)
 
 
 # At least on Linux, we can not use our own `ctypes_dylib` because `find_library` does not consult LD_LIBRARY_PATH and
@@ -323,7 +343,7 @@ def skip_if_lib_missing(libname, text=None):
 @skip_if_lib_missing('png', 'libpng.so (Ghostscript)')
 def test_ctypes_CDLL_find_library__png(pyi_builder):
     libname = 'png'
-    pyi_builder.test_source(_template_ctypes_CDLL_find_library % locals())
+    pyi_builder.test_source(_template_ctypes_CDLL_find_library.substitute(libname=repr(libname)))
 
 
 #-- Generate test-cases for the different types of ctypes objects.
@@ -333,62 +353,90 @@ def test_ctypes_CDLL_find_library__png(pyi_builder):
         assert lib is not None and lib._name is not None
         import sys, os
         if getattr(sys, 'frozen', False):
-            libfile = os.path.join(sys._MEIPASS, %(soname)r)
+            libfile = os.path.join(sys._MEIPASS, $soname)
             print(libfile)
-            assert os.path.isfile(libfile), '%(soname)s is missing'
+            assert os.path.isfile(libfile), $soname + ' is missing'
             print('>>> file found')
     """
 
+# Head of the test-case source, loading the library with the given function.
+_template_ctypes_gen_head = """
+        import ctypes ; from ctypes import *
+        lib = $funcname($soname)
+    """
+
+# Same as above, but with ctypes calls in a nested function; the body of `_template_ctypes_test` ends up in `g()`.
+_template_ctypes_in_func_gen_head = """
+    import ctypes ; from ctypes import *
+    def f():
+      def g():
+        lib = $funcname($soname)
+    """
+_template_ctypes_in_func_gen_tail = """
+      g()
+    f()
+    """
+
+# Complete test-case source templates, assembled and compiled once.
+_template_ctypes_gen = string.Template(textwrap.dedent(_template_ctypes_gen_head + _template_ctypes_test))
+_template_ctypes_in_func_gen = string.Template(
+    textwrap.dedent(_template_ctypes_in_func_gen_head + _template_ctypes_test + _template_ctypes_in_func_gen_tail)
+)
+
+# Marks used by the generated test-cases. `skipif_no_compiler` is evaluated only once, when `PyInstaller.utils.tests` is
+# imported, and is used as-is.
+_win32_mark = pytest.mark.win32
+
 parameters = []
 ids = []
+# Test-case source templates, keyed by test-id. The function name is filled in here, leaving only the soname to be
+# filled in by the test itself.
+_CTYPES_GEN_SOURCES = {}
+_CTYPES_IN_FUNC_GEN_SOURCES = {}
 for prefix in ('', 'ctypes.'):
     for funcname in ('CDLL', 'PyDLL', 'WinDLL', 'OleDLL', 'cdll.LoadLibrary'):
-        ids.append(prefix + funcname)
-        params = (prefix + funcname, ids[-1])
+        test_id = prefix + funcname
+        ids.append(test_id)
+        _CTYPES_GEN_SOURCES[test_id] = string.Template(_template_ctypes_gen.safe_substitute(funcname=test_id))
+        _CTYPES_IN_FUNC_GEN_SOURCES[test_id] = string.Template(
+            _template_ctypes_in_func_gen.safe_substitute(funcname=test_id)
+        )
+        params = test_id
         # Marking doesn't seem to chain here, so select just one skipping mark instead of both.
         if not has_compiler:
-            params = pytest.param(*params, marks=skipif_no_compiler(params))
+            params = pytest.param(params, marks=skipif_no_compiler)
         elif funcname in ("WinDLL", "OleDLL"):
             # WinDLL, OleDLL only work on windows.
-            params = pytest.param(*params, marks=pytest.mark.win32)
+            params = pytest.param(params, marks=_win32_mark)
         parameters.append(params)
 
 
-@pytest.mark.parametrize("funcname,test_id", parameters, ids=ids)
-def test_ctypes_gen(pyi_builder, monkeypatch, funcname, compiled_dylib, test_id):
+@pytest.mark.parametrize("test_id", parameters, ids=ids)
+def test_ctypes_gen(pyi_builder, compiled_dylib, test_id):
     # Evaluate the soname here, so the test-code contains a constant. We want the name of the dynamically-loaded library
     # only, not its path. See discussion in https://github.com/pyinstaller/pyinstaller/pull/1478#issuecomment-139622994.
     soname = compiled_dylib.basename
 
-    source = """
-        import ctypes ; from ctypes import *
-        lib = %s(%%(soname)r)
-    """ % funcname + _template_ctypes_test
-
-    __monkeypatch_resolveCtypesImports(monkeypatch, compiled_dylib.dirname)
-    pyi_builder.test_source(source % locals(), test_id=test_id)
+    # Add the directory with ctypes_dylib to pathex, so that `_resolveCtypesImports` finds the library.
+    pyi_builder.test_source(
+        _CTYPES_GEN_SOURCES[test_id].substitute(soname=repr(soname)),
+        pyi_args=['--paths', compiled_dylib.dirname],
+        test_id=test_id,
+    )
 
 
-@pytest.mark.parametrize("funcname,test_id", parameters, ids=ids)
-def test_ctypes_in_func_gen(pyi_builder, monkeypatch, funcname, compiled_dylib, test_id):
+@pytest.mark.parametrize("test_id", parameters, ids=ids)
+def test_ctypes_in_func_gen(pyi_builder, compiled_dylib, test_id):
     """
     This is much like test_ctypes_gen except that the ctypes calls are in a function. See issue #1620.
     """
     soname = compiled_dylib.basename
 
-    source = (
-        """
-    import ctypes ; from ctypes import *
-    def f():
-      def g():
-        lib = %s(%%(soname)r)
-    """ % funcname + _template_ctypes_test + """
-      g()
-    f()
-    """
+    pyi_builder.test_source(
+        _CTYPES_IN_FUNC_GEN_SOURCES[test_id].substitute(soname=repr(soname)),
+        pyi_args=['--paths', compiled_dylib.dirname],
+        test_id=test_id,
     )
-    __monkeypatch_resolveCtypesImports(monkeypatch, compiled_dylib.dirname)
-    pyi_builder.test_source(source % locals(), test_id=test_id)
 
 
 def test_ctypes_cdll_builtin_extension(pyi_builder):
@@ -425,8 +473,6 @@ def test_ctypes_cdll_builtin_extension(pyi_builder):
 
 
 def test_egg_unzipped(pyi_builder):
-    pathex = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'pyi_egg_unzipped.egg')
-    hooks_dir = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'hooks')
     pyi_builder.test_source(
         """
         # This code is part of the package for testing eggs in `PyInstaller`.
@@ -447,13 +493,11 @@ def test_egg_unzipped(pyi_builder):
 
         print('Okay.')
         """,
-        pyi_args=['--paths', pathex, '--additional-hooks-dir', hooks_dir],
+        pyi_args=['--paths', _PYI_EGG_PATH, '--additional-hooks-dir', _PYI_EGG_HOOKS],
     )
 
 
 def test_egg_unzipped_metadata_pkg_resources(pyi_builder):
-    pathex = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'pyi_egg_unzipped.egg')
-    hooks_dir = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'hooks')
     pyi_builder.test_source(
         """
         import pkg_resources
@@ -468,98 +512,105 @@ def test_egg_unzipped_metadata_pkg_resources(pyi_builder):
         # Project name is taken from egg name
         assert dist.project_name == 'pyi-egg-unzipped', f"Unexpected project name {dist.project_name!r}"
         """,
-        pyi_args=['--paths', pathex, '--additional-hooks-dir', hooks_dir],
+        pyi_args=['--paths', _PYI_EGG_PATH, '--additional-hooks-dir', _PYI_EGG_HOOKS],
     )
 
 
 def test_egg_unzipped_metadata_importlib_metadata(pyi_builder):
-    pathex = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'pyi_egg_unzipped.egg')
-    hooks_dir = os.path.join(_MODULES_DIR, 'pyi_test_egg', 'hooks')
+    # Select the implementation at build time, in the same way as `PyInstaller.compat` does: stdlib `importlib.metadata`
+    # under python >= 3.10, and its `importlib_metadata` backport (a requirement of PyInstaller) under older versions.
+    # The module is referred to by its actual name (and not via `import ... as` alias), so that PyInstaller's bytecode
+    # analysis can associate the function calls below with it.
+    importlib_metadata = "importlib.metadata" if is_py310 else "importlib_metadata"
+
     pyi_builder.test_source(
         """
-        try:
-            import importlib_metadata
-        except ModuleNotFoundError:
-            import importlib.metadata as importlib_metadata
+        import %(importlib_metadata)s
 
         # Metadata should be automatically collected due to importlib_metadata.version() call with literal argument
         # (which is picked up by PyInstaller's bytecode analysis).
-        version = importlib_metadata.version('pyi_egg_unzipped')
+        version = %(importlib_metadata)s.version('pyi_egg_unzipped')
         print(f"version: {version!r}")
         assert version == '0.1', f"Unexpected version {version!r}"
 
         # NOTE: in contrast to pkg_resources, importlib_metadata seems to read the name from metadata instead of
         # deriving it from egg directory name.
-        metadata = importlib_metadata.metadata('pyi_egg_unzipped')
+        metadata = %(importlib_metadata)s.metadata('pyi_egg_unzipped')
         print(f"metadata: {metadata!r}")
         assert metadata['Name'] == 'unzipped-egg', f"Unexpected Name {metadata['Name']!r}"
         assert metadata['Version'] == '0.1', f"Unexpected Version {metadata['Version']!r}"
 
-        dist = importlib_metadata.distribution('pyi_egg_unzipped')
+        dist = %(importlib_metadata)s.distribution('pyi_egg_unzipped')
         print(f"dist: {dist!r}")
         assert dist.name == 'unzipped-egg', f"Unexpected name {dist.name!r}"
         assert dist.version == '0.1', f"Unexpected version {dist.version!r}"
-        """,
-        pyi_args=['--paths', pathex, '--additional-hooks-dir', hooks_dir],
+        """ % {'importlib_metadata': importlib_metadata},
+        pyi_args=['--paths', _PYI_EGG_PATH, '--additional-hooks-dir', _PYI_EGG_HOOKS],
     )
 
 
 #--- namespaces ---
 
 
+# Turn the list of search paths into PyInstaller arguments. Each path is passed with its own --paths option, instead of
+# joining them with os.pathsep only for PyInstaller to split them again.
+def _paths_args(pathex):
+    return [arg for path in pathex for arg in ('--paths', path)]
+
+
 def test_nspkg1(pyi_builder):
     # Test inclusion of namespace packages implemented using pkg_resources.declare_namespace
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg1-pkg', '*.egg'))
+    pathex = _EGG_INDEX['nspkg1-pkg']
     pyi_builder.test_source(
         """
         import nspkg1.aaa
         import nspkg1.bbb.zzz
         import nspkg1.ccc
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
 def test_nspkg1_empty(pyi_builder):
     # Test inclusion of a namespace-only packages in an zipped egg. This package only defines the namespace, nothing is
     # contained there.
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg1-pkg', '*.egg'))
+    pathex = _EGG_INDEX['nspkg1-pkg']
     pyi_builder.test_source(
         """
         import nspkg1
         print (nspkg1)
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
 def test_nspkg1_bbb_zzz(pyi_builder):
     # Test inclusion of a namespace packages in an zipped egg
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg1-pkg', '*.egg'))
+    pathex = _EGG_INDEX['nspkg1-pkg']
     pyi_builder.test_source(
         """
         import nspkg1.bbb.zzz
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
 def test_nspkg2(pyi_builder):
     # Test inclusion of namespace packages implemented as nspkg.pth-files
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg2-pkg'))
+    pathex = [os.path.join(_MODULES_DIR, 'nspkg2-pkg')]
     pyi_builder.test_source(
         """
         import nspkg2.aaa
         import nspkg2.bbb.zzz
         import nspkg2.ccc
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
 @xfail(reason="modulegraph implements `pkgutil.extend_path` wrong")
 def test_nspkg3(pyi_builder):
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg3-pkg', '*.egg'))
+    pathex = _EGG_INDEX['nspkg3-pkg']
     pyi_builder.test_source(
         """
         import nspkg3.aaa
@@ -579,48 +630,46 @@ def test_nspkg3(pyi_builder):
             raise SystemExit('nspkg3.a found but should not')
         import nspkg3.ccc
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
-    )
-
-
-def test_nspkg3_empty(pyi_builder):
-    # Test inclusion of a namespace-only package in a zipped egg using pkgutil.extend_path. This package only defines
-    # namespace, nothing is contained there.
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg3-pkg', '*_empty.egg'))
-    pyi_builder.test_source(
-        """
-        import nspkg3
-        print (nspkg3)
-        """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
-def test_nspkg3_aaa(pyi_builder):
-    # Test inclusion of a namespace package in an directory using pkgutil.extend_path
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg3-pkg', '*.egg'))
+def _test_nspkg_imports(pyi_builder, pathex, modules):
+    # Import all given modules in a single frozen application. The imports must be literal import statements, so that
+    # they are picked up by PyInstaller's bytecode analysis.
     pyi_builder.test_source(
-        """
-        import nspkg3.aaa
-        """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        "\n".join(f"import {name}\nprint({name})" for name in modules),
+        pyi_args=_paths_args(pathex),
     )
 
 
-def test_nspkg3_bbb_zzz(pyi_builder):
-    # Test inclusion of a namespace package in an zipped egg using pkgutil.extend_path
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg3-pkg', '*.egg'))
-    pyi_builder.test_source(
-        """
-        import nspkg3.bbb.zzz
-        """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
-    )
+@pytest.mark.parametrize(
+    "pathex, modules",
+    [
+        # Test inclusion of a namespace-only package in a zipped egg using pkgutil.extend_path. This package only
+        # defines namespace, nothing is contained there.
+        pytest.param(
+            [path for path in _EGG_INDEX['nspkg3-pkg'] if path.endswith('_empty.egg')],
+            ['nspkg3'],
+            id='empty',
+        ),
+        # Test inclusion of a namespace package in an directory (nspkg3.aaa) and in an zipped egg (nspkg3.bbb.zzz)
+        # using pkgutil.extend_path. Both are available from the same set of eggs, so they are tested using a single
+        # build.
+        pytest.param(
+            _EGG_INDEX['nspkg3-pkg'],
+            ['nspkg3.aaa', 'nspkg3.bbb.zzz'],
+            id='aaa-bbb_zzz',
+        ),
+    ],
+)
+def test_nspkg3_imports(pyi_builder, pathex, modules):
+    _test_nspkg_imports(pyi_builder, pathex, modules)
 
 
 def test_nspkg_pep420(pyi_builder):
     # Test inclusion of PEP 420 namespace packages.
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg-pep420', 'path*'))
+    pathex = _NSPKG_PEP420_PATHS
     pyi_builder.test_source(
         """
         import package.sub1
@@ -628,7 +677,7 @@ def test_nspkg_pep420(pyi_builder):
         import package.subpackage.sub
         import package.nspkg.mod
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
@@ -637,7 +686,7 @@ def test_nspkg_attributes(pyi_builder):
     # pkg_resources.declare_namespace) have proper attributes:
     #  * __path__ attribute should contain at least one path
     #  * __file__ attribute should point to an __init__ file within __path__
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg1-pkg', '*.egg'))
+    pathex = _EGG_INDEX['nspkg1-pkg']
     pyi_builder.test_source(
         """
         import os
@@ -657,7 +706,7 @@ def validate_nspkg(pkg):
 
         validate_nspkg(nspkg1)
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
@@ -665,7 +714,7 @@ def test_nspkg_attributes_pep420(pyi_builder):
     # Test that PEP-420 namespace packages have proper attributes:
     #  * __path__ should contain at least one path
     #  * __file__ should be None
-    pathex = glob.glob(os.path.join(_MODULES_DIR, 'nspkg-pep420', 'path*'))
+    pathex = _NSPKG_PEP420_PATHS
     pyi_builder.test_source(
         """
         import package
@@ -682,7 +731,7 @@ def validate_nspkg_pep420(pkg):
         validate_nspkg_pep420(package)
         validate_nspkg_pep420(package.nspkg)
         """,
-        pyi_args=['--paths', os.pathsep.join(pathex)],
+        pyi_args=_paths_args(pathex),
     )
 
 
@@ -691,12 +740,10 @@ def validate_nspkg_pep420(pkg):
 
 # imp leaks file handles.
 @pytest.mark.filterwarnings("ignore", category=ResourceWarning)
-def test_pkg_without_hook_for_pkg(pyi_builder, script_dir):
+def test_pkg_without_hook_for_pkg(pyi_builder):
     # The package `pkg_without_hook_for_pkg` does not have a hook, but `pkg_without_hook_for_pkg.sub1` has one. And this
     # hook includes the "hidden" import `pkg_without_hook_for_pkg.sub1.sub11`
-    pyi_builder.test_source(
-        'import pkg_without_hook_for_pkg.sub1', ['--additional-hooks-dir=%s' % script_dir.join('pyi_hooks')]
-    )
+    pyi_builder.test_source('import pkg_without_hook_for_pkg.sub1', ['--additional-hooks-dir=%s' % _PYI_HOOKS_DIR])
 
 
 def test_app_with_plugin(pyi_builder, data_dir, monkeypatch):
@@ -728,15 +775,13 @@ def test_package_with_mixed_collection_mode(pyi_builder):
     # Test that PyInstaller's frozen importer and python's own `_frozen_importlib_external.PathFinder` complement, and
     # not exclude, each other. This is pre-requisite for having pure-python modules collected in PYZ archive, while
     # binary extensions (and some pure-python modules as well, if necessary) are collected as separate.
-    pathex = os.path.join(_MODULES_DIR, 'pyi_mixed_collection_mode', 'modules')
-    hooks_dir = os.path.join(_MODULES_DIR, 'pyi_mixed_collection_mode', 'hooks')
     pyi_builder.test_source(
         """
         import mypackage
         print(mypackage.a)
         print(mypackage.b)
         """,
-        pyi_args=['--paths', pathex, '--additional-hooks-dir', hooks_dir],
+        pyi_args=['--paths', _MIXED_COLLECTION_MODE_PATH, '--additional-hooks-dir', _MIXED_COLLECTION_MODE_HOOKS],
     )
 
 
@@ -745,12 +790,12 @@ def test_package_with_mixed_collection_mode(pyi_builder):
 # we can handle dynamic sys.path modifications within PYZ-collected packages and honor the order of entries in sys.path.
 
 
-# Shared implementation
-def _test_sys_path_with_vendored_package(pyi_builder, modification_type, expected_string, extra_pyi_args=None):
-    pathex = os.path.join(_MODULES_DIR, 'pyi_sys_path_with_vendored_package')
-
+# Shared implementation. The `scenarios` is a list of `(modification_type, expected_string)` tuples; all scenarios share
+# the same build, and each of them is run in a separate process (selected by command-line arguments), so that it starts
+# with pristine sys.path, sys.modules, and import machinery state.
+def _test_sys_path_with_vendored_package(pyi_builder, scenarios, extra_pyi_args=None):
     pyi_args = [
-        '--paths', pathex,
+        '--paths', _SYS_PATH_VENDORED,
         '--hiddenimport', 'myotherpackage._vendored.mypackage.mod',
     ]  # yapf: disable
 
@@ -761,40 +806,115 @@ def _test_sys_path_with_vendored_package(pyi_builder, modification_type, expecte
     if is_darwin:
         pyi_args += ['--windowed']
 
+    # Build the program and run the first scenario.
+    first_scenario, *other_scenarios = scenarios
     pyi_builder.test_source(
         """
+        import sys
         import myotherpackage
-        myotherpackage.setup_vendored_packages('{0}')
+
+        modification_type, expected_string = sys.argv[1:3]
+        myotherpackage.setup_vendored_packages(modification_type)
 
         import mypackage
         secret = mypackage.get_secret_string()
-        assert secret == '{1}', f"Unexpected secret string: {{secret!r}}"
-        """.format(modification_type, expected_string),
+        assert secret == expected_string, f"Unexpected secret string: {secret!r}"
+        """,
         pyi_args=pyi_args,
+        app_args=list(first_scenario),
     )
 
+    # Run the remaining scenarios with the same executable(s), in the same way as the first one.
+    for scenario in other_scenarios:
+        pyi_builder._test_executables('test_source', args=list(scenario), runtime=None, run_from_path=False)
+
 
 # In this scenario, we have only vendored package available - we intentionally suppress collection of stand-alone
-# package during the build.
+# package during the build. This requires a different build than the scenarios below.
 def test_sys_path_with_vendored_package_no_standalone(pyi_builder):
-    _test_sys_path_with_vendored_package(pyi_builder, "append", "vendored", ["--exclude", "mypackage"])
-
+    _test_sys_path_with_vendored_package(pyi_builder, [("append", "vendored")], ["--exclude", "mypackage"])
 
-# In this scenario, we have both stand-alone and vendored package available in sys.path; vendored package directory is
-# appended to sys.path, so we expect to import the stand-alone version.
-def test_sys_path_with_vendored_package_append(pyi_builder):
-    _test_sys_path_with_vendored_package(pyi_builder, "append", "standalone")
 
-
-# In this scenario, we have both stand-alone and vendored package available in sys.path; vendored package directory is
-# prepended to sys.path, so we expect to import the vendored version.
-def test_sys_path_with_vendored_package_prepend(pyi_builder):
-    _test_sys_path_with_vendored_package(pyi_builder, "prepend", "vendored")
+# In these scenarios, we have both stand-alone and vendored package available in sys.path. They share the same build,
+# and each of them is run with the same executable:
+#  * vendored package directory is appended to sys.path, so we expect to import the stand-alone version.
+#  * vendored package directory is prepended to sys.path, so we expect to import the vendored version.
+def test_sys_path_with_vendored_package_append_and_prepend(pyi_builder):
+    _test_sys_path_with_vendored_package(pyi_builder, [("append", "standalone"), ("prepend", "vendored")])
 
 
 # Tests for run-time sys.path modifications that result in a PEP420 namespace package being split across different
 # locations, both within the PYZ archive and in location external to frozen application.
 
+# The test program runs one of the scenarios, selected by its second command-line argument. Each scenario is a function
+# that imports the namespace package's parts; the parts are listed in the import order, each with the sys.path
+# modification (if any) that makes it importable.
+_SPLIT_NS_PREAMBLE = textwrap.dedent(
+    """
+    import sys
+
+    external_path = sys.argv[1]
+    from myotherpackage import vendored_path
+    """
+).strip()
+_SPLIT_NS_IMPORT = "import mynamespacepackage.{0}\nprint(mynamespacepackage.{0})"
+_SPLIT_NS_STEPS = {
+    'forward': [
+        (None, 'standalone_pyz'),
+        (None, 'standalone_py'),
+        ('sys.path.append(vendored_path)', 'vendored_pyz'),
+        (None, 'vendored_py'),
+        ('sys.path.append(external_path)', 'external_py'),
+    ],
+    'reverse': [
+        ('sys.path.insert(0, external_path)', 'external_py'),
+        ('sys.path.insert(1, vendored_path)', 'vendored_py'),
+        (None, 'vendored_pyz'),
+        (None, 'standalone_py'),
+        (None, 'standalone_pyz'),
+    ],
+}
+# With 'all_in_advance', sys.path is modified up front with a single statement, to the same effect as the individual
+# modifications above.
+_SPLIT_NS_PATH_SETUP = {
+    'forward': 'sys.path += [vendored_path, external_path]',
+    'reverse': 'sys.path[:0] = [external_path, vendored_path]',
+}
+_SPLIT_NS_SCENARIOS = [
+    f'{import_order}_{path_modification}' for import_order in ('forward', 'reverse')
+    for path_modification in ('one_by_one', 'all_in_advance')
+]
+
+
+def _split_ns_scenario(scenario):
+    import_order, path_modification = scenario.split('_', 1)
+    steps = _SPLIT_NS_STEPS[import_order]
+    blocks = []
+    if path_modification == 'all_in_advance':
+        blocks.append(_SPLIT_NS_PATH_SETUP[import_order])
+        steps = [(None, name) for _, name in steps]
+    for path_stmt, name in steps:
+        blocks.append("\n".join(filter(None, [path_stmt, _SPLIT_NS_IMPORT.format(name)])))
+    return f"def {scenario}():\n" + textwrap.indent("\n\n".join(blocks), '    ')
+
+
+def _split_ns_program():
+    parts = [_SPLIT_NS_PREAMBLE]
+    parts += [_split_ns_scenario(scenario) for scenario in _SPLIT_NS_SCENARIOS]
+    # Dispatch to the scenario function named by the second command-line argument.
+    parts += ["globals()[sys.argv[2]]()"]
+    return "\n\n\n".join(parts) + "\n"
+
+
+_SPLIT_NS_PROGRAM = _split_ns_program()
+
+# Build arguments; the hidden imports of the vendored modules are declared by the hook for `myotherpackage`. On macOS,
+# also build and test .app bundle executable.
+_SPLIT_NS_PYI_ARGS = (
+    '--paths', _SPLIT_NS_MODULES,
+    '--additional-hooks-dir', _SPLIT_NS_HOOKS,
+) + (('--windowed',) if is_darwin else ())  # yapf: disable
+
 
 # The test supports two import orders: standalone part, vendored part, external part; and reverse. Both orders are
 # tested in case it matters whether the namespace package is first discovered by PyInstaller's frozen importer or by
@@ -802,129 +922,20 @@ def test_sys_path_with_vendored_package_prepend(pyi_builder):
 # Additionally, two sys.path modification strategies are tested: adding each new entry just before we import the
 # corresponding module, or adding all entries in advance. Adding entries one by one should trigger recomputation
 # of the `_NamespacePath` object on each subsequent import.
-@pytest.mark.parametrize('import_order', ['forward', 'reverse'])
-@pytest.mark.parametrize('path_modification', ['one_by_one', 'all_in_advance'])
-def test_split_location_pep420_namespace_package(pyi_builder, import_order, path_modification):
-    modules_root = os.path.join(_MODULES_DIR, 'pyi_split_location_pep420_namespace_package')
-
-    pyi_args = [
-        '--paths', os.path.join(modules_root, 'modules'),
-        '--additional-hooks-dir', os.path.join(modules_root, 'hooks'),
-        '--hiddenimport', 'myotherpackage._vendored.mynamespacepackage.vendored_pyz',
-        '--hiddenimport', 'myotherpackage._vendored.mynamespacepackage.vendored_py',
-    ]  # yapf: disable
-
-    # On macOS, also build and test .app bundle executable
-    if is_darwin:
-        pyi_args += ['--windowed']
-
-    # Path to external part needs to be passed to program via command-line arguments
-    app_args = [os.path.join(modules_root, 'external-location')]
-
-    # Test programs for all four combinations
-    _test_programs = {}
-    _test_programs[('forward', 'one_by_one')] = \
-        """
-        import sys
-
-        external_path = sys.argv[1]
-        from myotherpackage import vendored_path
-
-        import mynamespacepackage.standalone_pyz
-        print(mynamespacepackage.standalone_pyz)
-
-        import mynamespacepackage.standalone_py
-        print(mynamespacepackage.standalone_py)
-
-        sys.path.append(vendored_path)
-        import mynamespacepackage.vendored_pyz
-        print(mynamespacepackage.vendored_pyz)
-
-        import mynamespacepackage.vendored_py
-        print(mynamespacepackage.vendored_py)
-
-        sys.path.append(external_path)
-        import mynamespacepackage.external_py
-        print(mynamespacepackage.external_py)
-        """
-    _test_programs[('forward', 'all_in_advance')] = \
-        """
-        import sys
-
-        external_path = sys.argv[1]
-        from myotherpackage import vendored_path
-
-        sys.path.append(vendored_path)
-        sys.path.append(external_path)
-
-        import mynamespacepackage.standalone_pyz
-        print(mynamespacepackage.standalone_pyz)
-
-        import mynamespacepackage.standalone_py
-        print(mynamespacepackage.standalone_py)
-
-        import mynamespacepackage.vendored_pyz
-        print(mynamespacepackage.vendored_pyz)
-
-        import mynamespacepackage.vendored_py
-        print(mynamespacepackage.vendored_py)
-
-        import mynamespacepackage.external_py
-        print(mynamespacepackage.external_py)
-        """
-    _test_programs[('reverse', 'one_by_one')] = \
-        """
-        import sys
-
-        external_path = sys.argv[1]
-        from myotherpackage import vendored_path
-
-        sys.path.insert(0, external_path)
-        import mynamespacepackage.external_py
-        print(mynamespacepackage.external_py)
-
-        sys.path.insert(1, vendored_path)
-        import mynamespacepackage.vendored_py
-        print(mynamespacepackage.vendored_py)
-
-        import mynamespacepackage.vendored_pyz
-        print(mynamespacepackage.vendored_pyz)
-
-        import mynamespacepackage.standalone_py
-        print(mynamespacepackage.standalone_py)
-
-        import mynamespacepackage.standalone_pyz
-        print(mynamespacepackage.standalone_pyz)
-        """
-    _test_programs[('reverse', 'all_in_advance')] = \
-        """
-        import sys
-
-        external_path = sys.argv[1]
-        from myotherpackage import vendored_path
-
-        sys.path.insert(0, external_path)
-        sys.path.insert(1, vendored_path)
-
-        import mynamespacepackage.external_py
-        print(mynamespacepackage.external_py)
-
-        import mynamespacepackage.vendored_py
-        print(mynamespacepackage.vendored_py)
-
-        import mynamespacepackage.vendored_pyz
-        print(mynamespacepackage.vendored_pyz)
-
-        import mynamespacepackage.standalone_py
-        print(mynamespacepackage.standalone_py)
-
-        import mynamespacepackage.standalone_pyz
-        print(mynamespacepackage.standalone_pyz)
-        """
-
-    # Build and run the appropriate test program
-    pyi_builder.test_source(
-        _test_programs[(import_order, path_modification)],
-        pyi_args=pyi_args,
-        app_args=app_args,
-    )
+# All four scenarios share the same build; each of them is run in a separate process, so that it starts with pristine
+# sys.path and sys.modules.
+def test_split_location_pep420_namespace_package(pyi_builder):
+    # Path to external part needs to be passed to program via command-line arguments. Build the program and run the
+    # first scenario.
+    first_scenario, *other_scenarios = _SPLIT_NS_SCENARIOS
+    pyi_builder.test_source(
+        _SPLIT_NS_PROGRAM,
+        pyi_args=list(_SPLIT_NS_PYI_ARGS),
+        app_args=[_SPLIT_NS_EXTERNAL, first_scenario],
+    )
+
+    # Run the remaining scenarios with the same executable(s), in the same way as the first one.
+    for scenario in other_scenarios:
+        pyi_builder._test_executables(
+            'test_source', args=[_SPLIT_NS_EXTERNAL, scenario], runtime=None, run_from_path=False
+        )